@@ -5,6 +5,7 @@ Creates printable flashcards for learning treble and bass clef notes.
 """
 
 from PIL import Image, ImageDraw, ImageFont
+import numpy as np
 import math
 import os
 
@@ -18,6 +19,13 @@ CARD_WIDTH_MM = 69  # 34.5mm folded in half
 CARD_HEIGHT_MM = 27
 CARD_WIDTH = int(CARD_WIDTH_MM * MM_TO_INCH * DPI)
 CARD_HEIGHT = int(CARD_HEIGHT_MM * MM_TO_INCH * DPI)
+HALF_CARD_W = CARD_WIDTH // 2  # Fold line / width of each half
+HALF_CARD_H = CARD_HEIGHT // 2
+
+# Note head size (38 x 28 pixels) and horizontal position on the stave
+NOTE_HALF_W = 19
+NOTE_HALF_H = 14
+NOTE_X = CARD_WIDTH / 3.5
 
 # A4 dimensions (landscape orientation)
 A4_WIDTH = int(297 * MM_TO_INCH * DPI)  # 297mm wide (landscape)
@@ -27,21 +35,72 @@ A4_HEIGHT = int(210 * MM_TO_INCH * DPI)  # 210mm tall (landscape)
 MARGIN_MM = 10
 MARGIN = int(MARGIN_MM * MM_TO_INCH * DPI)
 
+# Fold line dashes (in pixels)
+FOLD_DASH_LENGTH = 10
+FOLD_GAP_LENGTH = 5
+
+
+def build_fold_strip():
+    """Build the 1 pixel wide dashed gray fold line as an image."""
+    strip = np.full((CARD_HEIGHT, 1), 255, dtype=np.uint8)
+
+    # Each dash covers both of its end points, like a drawn line would
+    rows = np.arange(CARD_HEIGHT) % (FOLD_DASH_LENGTH + FOLD_GAP_LENGTH)
+    strip[rows <= FOLD_DASH_LENGTH] = 128  # PIL's 'gray'
+
+    return Image.fromarray(strip)
+
+
+FOLD_STRIP = build_fold_strip()
+
+
+def build_note_stamp():
+    """Rasterize the filled note head ellipse once as a boolean mask."""
+    scratch = Image.new('L', (2 * NOTE_HALF_W + 1, 2 * NOTE_HALF_H + 1), 'white')
+    ImageDraw.Draw(scratch).ellipse(
+        [(0, 0), (2 * NOTE_HALF_W, 2 * NOTE_HALF_H)],
+        fill='black'
+    )
+    return np.asarray(scratch) == 0
+
+
+# Note pieces, stamped into the card pixels by draw_note
+NOTE_STAMP = build_note_stamp()
+STEM_STAMP = np.ones((81, 6), dtype=bool)  # 80 pixels long, 6 wide
+LEDGER_STAMP = np.ones((2, 51), dtype=bool)  # 50 pixels long, 2 high
+
 # Load background images
 TREBLE_BG = None
 BASS_BG = None
 
+# Resized backgrounds and their stave lines, keyed by clef type
+_RESIZED_CACHE = {}
+
+# Blank card per clef (background, fold line and border)
+TREBLE_TEMPLATE = None
+BASS_TEMPLATE = None
+
+# Answer font, loaded on first use
+_FONT = None
+
+# Rotated answer text masks and their positions, keyed by note name
+_ROTATED_GLYPHS = {}
+
 def load_backgrounds():
     """Load and cache the background images."""
-    global TREBLE_BG, BASS_BG
+    global TREBLE_BG, BASS_BG, TREBLE_TEMPLATE, BASS_TEMPLATE
 
     treble_path = "treble.png"
     bass_path = "bass-clef.png"
 
     def load_and_convert(path):
-        """Load image and properly convert to black and white RGB."""
+        """Load image and properly convert to black and white grayscale."""
         img = Image.open(path)
 
+        # Let the decoder pre-shrink large sources (only JPEG supports this,
+        # other formats ignore it)
+        img.draft('L', (CARD_WIDTH, CARD_HEIGHT))
+
         # Handle transparency by compositing onto white background
         if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
             # Create white background
@@ -54,7 +113,13 @@ def load_backgrounds():
         else:
             img = img.convert('RGB')
 
-        return img
+        # Output is black, gray and white only, so work in 8-bit grayscale
+        return img.convert('L')
+
+    # Resized copies and templates of previously loaded backgrounds are now stale
+    _RESIZED_CACHE.clear()
+    TREBLE_TEMPLATE = None
+    BASS_TEMPLATE = None
 
     if os.path.exists(treble_path):
         TREBLE_BG = load_and_convert(treble_path)
@@ -67,6 +132,52 @@ def load_backgrounds():
         print(f"Warning: {bass_path} not found")
 
 
+def _select_peaks(candidates, min_distance, count):
+    """
+    Keep up to count candidate rows (darkest first) that are at least
+    min_distance away from every row already kept.
+    """
+    lines = np.empty(count, dtype=np.int64)
+    kept = 0
+
+    for peak in candidates:
+        too_close = False
+        for i in range(kept):
+            if abs(peak - lines[i]) < min_distance:
+                too_close = True
+                break
+
+        if not too_close:
+            lines[kept] = peak
+            kept += 1
+            if kept == count:
+                break
+
+    return lines[:kept]
+
+
+def _find_lines(profile, min_distance, count=5):
+    """
+    Find the count darkest bands in a vertical darkness profile.
+    Returns their rows from top to bottom (fewer if there are not enough).
+    """
+    # Smooth out single-pixel noise and anti-aliasing; the centre-weighted
+    # kernel keeps a 1 pixel line a single-row peak rather than a flat top
+    smoothed = np.convolve(profile, np.array([1, 2, 1]) / 4, mode='same')
+
+    # Local maxima (first row of a flat top) whose own pixel is dark enough to
+    # be a line (darker than 128 gray), so thin lines survive the smoothing
+    is_peak = (smoothed[1:-1] > smoothed[:-2]) & (smoothed[1:-1] >= smoothed[2:])
+    peaks = np.flatnonzero(is_peak) + 1
+    peaks = peaks[profile[peaks] > 127]
+
+    # Keep the darkest peaks, skipping any too close to one already kept
+    candidates = peaks[np.argsort(-smoothed[peaks], kind='stable')].astype(np.int64)
+    lines = _select_peaks(candidates, min_distance, count)
+
+    return np.sort(lines).tolist()
+
+
 def get_stave_info(bg_image):
     """
     Analyze background image to find stave line positions.
@@ -76,73 +187,189 @@ def get_stave_info(bg_image):
     # We need to detect these lines to properly position notes
 
     width, height = bg_image.size
-    pixels = bg_image.load()
 
     # Scan vertically in the middle of the image to find black lines
     scan_x = width // 2
-    lines = []
-    in_line = False
-    line_start = 0
-
-    for y in range(height):
-        pixel = pixels[scan_x, y]
-        # Check if pixel is dark (black line)
-        is_dark = sum(pixel[:3]) < 384  # Less than 128 average
-
-        if is_dark and not in_line:
-            in_line = True
-            line_start = y
-        elif not is_dark and in_line:
-            in_line = False
-            # Store the middle of the line
-            lines.append((line_start + y) // 2)
+    column = np.asarray(bg_image.convert('L'))[:, scan_x]
+    darkness = 255 - column.astype(np.int16)
+
+    # Stave lines are far further apart than they are thick
+    lines = _find_lines(darkness, max(height // 20, 3))
 
     # We should have 5 lines
-    if len(lines) >= 5:
-        # Return the 5 most prominent lines
-        return lines[:5]
+    if len(lines) == 5:
+        return lines
 
     # Fallback: estimate line positions
     line_spacing = height // 6
     return [line_spacing * (i + 1) for i in range(5)]
 
 
-def draw_note(draw, x, y, ledger_line=False):
-    """Draw a note head (filled ellipse) and optionally a ledger line."""
-    note_width = 38
-    note_height = 28
+def get_resized_bg(clef_type):
+    """
+    Resize the clef background to fit the left half of a card.
+    Returns (bg_resized, stave_lines, paste_x, paste_y), or None if the
+    background is not loaded. Results are cached per clef type.
+    """
+    if clef_type in _RESIZED_CACHE:
+        return _RESIZED_CACHE[clef_type]
+
+    # Get the appropriate background image
+    bg_image = TREBLE_BG if clef_type == "treble" else BASS_BG
+    if not bg_image:
+        return None
+
+    # Resize background to fit the left half of the card
+    left_half_width = HALF_CARD_W
+    aspect_ratio = bg_image.height / bg_image.width
+    new_height = int(left_half_width * aspect_ratio)
+
+    # Center vertically
+    if new_height > CARD_HEIGHT:
+        new_height = CARD_HEIGHT
+        new_width = int(new_height / aspect_ratio)
+    else:
+        new_width = left_half_width
+
+    bg_resized = bg_image.resize((new_width, new_height), Image.Resampling.BILINEAR)
+
+    # Centered on left half
+    paste_x = (left_half_width - new_width) // 2
+    paste_y = (CARD_HEIGHT - new_height) // 2
+
+    # Get stave line positions from the resized background
+    stave_lines = get_stave_info(bg_resized)
+
+    _RESIZED_CACHE[clef_type] = (bg_resized, stave_lines, paste_x, paste_y)
+    return _RESIZED_CACHE[clef_type]
+
+
+def get_font():
+    """Load and cache the font used for the answer text."""
+    global _FONT
+
+    if _FONT is None:
+        try:
+            # Try to use a nice font, fall back to default if not available
+            _FONT = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", 60)
+        except:
+            _FONT = ImageFont.load_default()
+
+    return _FONT
+
+
+def get_answer_image(text):
+    """
+    Render the answer text rotated 180 degrees for flip-over.
+    Returns the glyph mask and its position on the card, centered on the
+    right half. Results are cached, so each note name is only rendered once.
+    """
+    if text in _ROTATED_GLYPHS:
+        return _ROTATED_GLYPHS[text]
+
+    font = get_font()
+
+    # Glyph coverage as an 8-bit mask, cropped to the inked pixels
+    mask = font.getmask(text, mode='L')
+    mask_img = Image.frombytes('L', mask.size, bytes(mask))
+
+    # Rotate 180 degrees (a plain flip, no resampling needed)
+    mask_img = mask_img.transpose(Image.Transpose.ROTATE_180)
+
+    # Center the glyphs on the right half
+    text_x = HALF_CARD_W + (HALF_CARD_W - mask_img.width) // 2
+    text_y = (CARD_HEIGHT - mask_img.height) // 2
+
+    _ROTATED_GLYPHS[text] = (mask_img, (text_x, text_y))
+    return _ROTATED_GLYPHS[text]
+
 
+def _stamp(card, mask, top, left):
+    """Set the pixels of card covered by mask (placed at top, left) to black."""
+    height, width = mask.shape
+
+    # Clip the stamp to the card
+    y0, x0 = max(top, 0), max(left, 0)
+    y1, x1 = min(top + height, card.shape[0]), min(left + width, card.shape[1])
+    if y0 >= y1 or x0 >= x1:
+        return
+
+    card[y0:y1, x0:x1][mask[y0 - top:y1 - top, x0 - left:x1 - left]] = 0
+
+
+def draw_note(card, x, y, ledger_line=False):
+    """
+    Draw a note head (filled ellipse) and optionally a ledger line.
+    card is the card's pixels as a writable NumPy array; x and y are pixel
+    coordinates of the centre of the note head.
+    """
     # Draw ledger line if needed
     if ledger_line:
-        ledger_x_start = x - 25
-        ledger_x_end = x + 25
-        draw.line(
-            [(ledger_x_start, y), (ledger_x_end, y)],
-            fill='black',
-            width=2
-        )
+        _stamp(card, LEDGER_STAMP, y, x - 25)
 
     # Draw note head
-    draw.ellipse(
-        [(x - note_width//2, y - note_height//2),
-         (x + note_width//2, y + note_height//2)],
-        fill='black'
-    )
+    _stamp(card, NOTE_STAMP, y - NOTE_HALF_H, x - NOTE_HALF_W)
 
-    # Draw stem
-    stem_y_start = y
-    if(y>CARD_HEIGHT//2):
-        stem_x = x + note_width//2
-        stem_y_end = y - 80
+    # Draw stem (the -3 / -2 offsets copy how PIL rasterizes a width-6 line,
+    # which shifts by one pixel depending on the line's direction)
+    if(y>HALF_CARD_H):
+        stem_x = x + NOTE_HALF_W
+        _stamp(card, STEM_STAMP, y - 80, stem_x - 3)
     else:
-        stem_x = x - note_width//2
-        stem_y_end = y + 80
-    draw.line(
-        [(stem_x, stem_y_start), (stem_x, stem_y_end)],
-        fill='black',
-        width=6
+        stem_x = x - NOTE_HALF_W
+        _stamp(card, STEM_STAMP, y, stem_x - 2)
+
+
+def build_template(clef_type):
+    """
+    Build the blank card for a clef: background, fold line and border.
+    Everything that is the same on every card of that clef is drawn here once.
+    """
+    img = Image.new('L', (CARD_WIDTH, CARD_HEIGHT), 'white')
+    draw = ImageDraw.Draw(img)
+
+    resized = get_resized_bg(clef_type)
+
+    if resized:
+        bg_resized, _, paste_x, paste_y = resized
+
+        # Paste background centered on left half
+        img.paste(bg_resized, (paste_x, paste_y))
+
+    # Draw fold line in the middle (dashed)
+    img.paste(FOLD_STRIP, (HALF_CARD_W, 0))
+
+    # Draw border (cut line) around the card
+    draw.rectangle(
+        [(0, 0), (CARD_WIDTH - 1, CARD_HEIGHT - 1)],
+        outline='black',
+        width=2
     )
 
+    return img
+
+
+def load_templates():
+    """Build and cache the blank card templates for both clefs."""
+    global TREBLE_TEMPLATE, BASS_TEMPLATE
+
+    TREBLE_TEMPLATE = build_template("treble")
+    BASS_TEMPLATE = build_template("bass")
+
+
+def get_template(clef_type):
+    """Return the blank card for a clef, building and caching it if needed."""
+    global TREBLE_TEMPLATE, BASS_TEMPLATE
+
+    if clef_type == "treble":
+        if TREBLE_TEMPLATE is None:
+            TREBLE_TEMPLATE = build_template("treble")
+        return TREBLE_TEMPLATE
+
+    if BASS_TEMPLATE is None:
+        BASS_TEMPLATE = build_template("bass")
+    return BASS_TEMPLATE
+
 
 def create_flashcard(note_name, clef_type, position):
     """
@@ -154,34 +381,12 @@ def create_flashcard(note_name, clef_type, position):
         position: Vertical position (0 = bottom line, increases upward)
                  Negative values are below the stave, positive values above
     """
-    img = Image.new('RGB', (CARD_WIDTH, CARD_HEIGHT), 'white')
-    draw = ImageDraw.Draw(img)
+    card = np.array(get_template(clef_type))
 
-    # Get the appropriate background image
-    bg_image = TREBLE_BG if clef_type == "treble" else BASS_BG
-
-    if bg_image:
-        # Resize background to fit the left half of the card
-        left_half_width = CARD_WIDTH // 2
-        aspect_ratio = bg_image.height / bg_image.width
-        new_height = int(left_half_width * aspect_ratio)
-
-        # Center vertically
-        if new_height > CARD_HEIGHT:
-            new_height = CARD_HEIGHT
-            new_width = int(new_height / aspect_ratio)
-        else:
-            new_width = left_half_width
-
-        bg_resized = bg_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-        # Paste background centered on left half
-        paste_x = (left_half_width - new_width) // 2
-        paste_y = (CARD_HEIGHT - new_height) // 2
-        img.paste(bg_resized, (paste_x, paste_y))
+    resized = get_resized_bg(clef_type)
 
-        # Get stave line positions from the resized background
-        stave_lines = get_stave_info(bg_resized)
+    if resized:
+        _, stave_lines, _, paste_y = resized
 
         if len(stave_lines) >= 5:
             # Calculate note position
@@ -197,60 +402,20 @@ def create_flashcard(note_name, clef_type, position):
 
             # Note x position (right side of stave)
             # note_x = paste_x + new_width - 60
-            note_x = CARD_WIDTH / 3.5
+            note_x = NOTE_X
 
             # Determine if we need ledger lines
             needs_ledger = position < -1 or position > 9
 
-            draw_note(draw, note_x, int(note_y), needs_ledger)
+            draw_note(card, int(note_x), int(note_y), needs_ledger)
 
-    # Draw fold line in the middle (dashed)
-    middle_x = CARD_WIDTH // 2
-    dash_length = 10
-    gap_length = 5
-    y = 0
-    while y < CARD_HEIGHT:
-        draw.line(
-            [(middle_x, y), (middle_x, min(y + dash_length, CARD_HEIGHT))],
-            fill='gray',
-            width=1
-        )
-        y += dash_length + gap_length
+    img = Image.fromarray(card)
 
     # RIGHT SIDE: Answer (rotated 180 degrees for flip-over)
-    try:
-        # Try to use a nice font, fall back to default if not available
-        font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", 60)
-    except:
-        font = ImageFont.load_default()
-
-    # Create text on a temporary image, then rotate it
-    text = note_name
-    bbox = draw.textbbox((0, 0), text, font=font)
-    text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
-
-    # Create temporary image for text
-    text_img = Image.new('RGB', (text_width + 20, text_height + 20), 'white')
-    text_draw = ImageDraw.Draw(text_img)
-    text_draw.text((10, 10), text, fill='black', font=font)
-
-    # Rotate 180 degrees
-    text_img = text_img.rotate(180, expand=False)
-
-    # Calculate position to center on right half
-    text_x = middle_x + (CARD_WIDTH // 2 - text_img.width) // 2
-    text_y = (CARD_HEIGHT - text_img.height) // 2
+    text_mask, text_position = get_answer_image(note_name)
 
     # Paste the rotated text
-    img.paste(text_img, (text_x, text_y))
-
-    # Draw border (cut line) around the card
-    draw.rectangle(
-        [(0, 0), (CARD_WIDTH - 1, CARD_HEIGHT - 1)],
-        outline='black',
-        width=2
-    )
+    img.paste('black', text_position, text_mask)
 
     return img
 
@@ -299,7 +464,11 @@ BASS_NOTES = [
 
 
 def arrange_on_a4(flashcards):
-    """Arrange flashcards on A4 sheets with margins."""
+    """
+    Arrange flashcards on A4 sheets with margins and save each sheet.
+    All sheets are built in one reused pixel buffer, so each one is saved
+    before the next overwrites it.
+    """
     # Calculate printable area (after margins)
     printable_width = A4_WIDTH - (2 * MARGIN)
     printable_height = A4_HEIGHT - (2 * MARGIN)
@@ -312,25 +481,36 @@ def arrange_on_a4(flashcards):
     print(f"Cards per sheet: {cards_per_sheet} ({cards_per_row} x {cards_per_col})")
     print(f"Print margin: {MARGIN_MM}mm on each side")
 
-    sheets = []
-    for sheet_num in range(0, len(flashcards), cards_per_sheet):
-        sheet = Image.new('RGB', (A4_WIDTH, A4_HEIGHT), 'white')
+    # Allocate the sheet and card buffers once and reuse them for every sheet
+    sheet_np = np.empty((A4_HEIGHT, A4_WIDTH), dtype=np.uint8)
+    cards_np = np.empty((cards_per_sheet, CARD_HEIGHT, CARD_WIDTH), dtype=np.uint8)
 
-        cards_on_sheet = flashcards[sheet_num:sheet_num + cards_per_sheet]
+    # View of the area inside the margins as (row, col, y, x) card slots:
+    # cards fill each row left to right, rows top to bottom
+    slots = (sheet_np[MARGIN:MARGIN + cards_per_col * CARD_HEIGHT,
+                      MARGIN:MARGIN + cards_per_row * CARD_WIDTH]
+             .reshape(cards_per_col, CARD_HEIGHT, cards_per_row, CARD_WIDTH)
+             .transpose(0, 2, 1, 3))
 
-        for idx, card in enumerate(cards_on_sheet):
-            row = idx // cards_per_row
-            col = idx % cards_per_row
+    num_sheets = math.ceil(len(flashcards) / cards_per_sheet)
+    print(f"\nSaving {num_sheets} A4 sheet(s)...")
 
-            # Add margin offset to position
-            x = MARGIN + (col * CARD_WIDTH)
-            y = MARGIN + (row * CARD_HEIGHT)
+    for sheet_idx in range(num_sheets):
+        cards_on_sheet = flashcards[sheet_idx * cards_per_sheet:(sheet_idx + 1) * cards_per_sheet]
+        sheet_np.fill(255)
 
-            sheet.paste(card, (x, y))
+        # Stack the cards and pad the last rows with blank (white) cards
+        np.stack([np.asarray(card) for card in cards_on_sheet], out=cards_np[:len(cards_on_sheet)])
+        cards_np[len(cards_on_sheet):] = 255
 
-        sheets.append(sheet)
+        # Tile all cards onto the sheet in one assignment
+        slots[:] = cards_np.reshape(cards_per_col, cards_per_row, CARD_HEIGHT, CARD_WIDTH)
 
-    return sheets
+        # The image shares sheet_np, so save it before the next sheet is drawn
+        filename = f"flashcards_sheet_{sheet_idx + 1}.png"
+        # Fast zlib level: encoding dominates runtime, file size matters less
+        Image.fromarray(sheet_np).save(filename, dpi=(DPI, DPI), compress_level=1, optimize=False)
+        print(f"Saved: {filename}")
 
 
 def main():
@@ -340,6 +520,9 @@ def main():
     # Load background images
     load_backgrounds()
 
+    # Build the blank card for each clef once
+    load_templates()
+
     flashcards = []
 
     # Generate treble clef cards
@@ -356,16 +539,9 @@ def main():
 
     print(f"\nTotal flashcards: {len(flashcards)}")
 
-    # Arrange on A4 sheets
+    # Arrange on A4 sheets and save them
     print("\nArranging flashcards on A4 sheets...")
-    sheets = arrange_on_a4(flashcards)
-
-    # Save sheets
-    print(f"\nSaving {len(sheets)} A4 sheet(s)...")
-    for idx, sheet in enumerate(sheets, 1):
-        filename = f"flashcards_sheet_{idx}.png"
-        sheet.save(filename, dpi=(DPI, DPI))
-        print(f"Saved: {filename}")
+    arrange_on_a4(flashcards)
 
     print("\nDone! Print the sheet(s) in landscape orientation and cut/fold each card along the center line.")
     print("Each card is 69mm x 27mm (folds to 34.5mm x 27mm).")